@@ -4,15 +4,19 @@ Shopping Store Event Simulator
 Generates realistic e-commerce events for the ML feature pipeline
 """
 
-import requests
+import aiohttp
+import asyncio
+import ctypes
+import orjson
+import os
 import random
 import time
-import json
 import logging
 from datetime import datetime
 from typing import Dict, List
 import argparse
-import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -32,171 +36,368 @@ PRODUCTS = {
     "notebook": {"category": "books", "price": 10.0},
 }
 
+PRODUCT_NAMES = tuple(PRODUCTS.keys())
+
 EVENTS_TYPES = ["login", "view", "add_to_cart", "remove_from_cart", "purchase", "logout"]
 
+# Cap on simultaneous in-flight POSTs; matches the connector pool size
+MAX_INFLIGHT_REQUESTS = 500
+
+# Flush the event batch when it reaches this size or age, whichever first
+BATCH_MAX_EVENTS = 50
+BATCH_FLUSH_INTERVAL = 1.0
+
+# Cap on simultaneously running sessions per load-test worker process;
+# uncapped task counts just trade throughput for scheduler overhead
+MAX_CONCURRENT_SESSIONS = 100
+
+CLOCK_MONOTONIC = 1
+
+# Cached (epoch_second, formatted prefix) for utcnow_iso
+_ts_second = 0
+_ts_prefix = ""
+
+
+def utcnow_iso() -> str:
+    """ISO-8601 UTC timestamp without a datetime object per call
+
+    The second-resolution prefix is formatted once per wall-clock second;
+    only the nanosecond suffix is rendered per event, keeping timestamps
+    unique (they feed the ingestion service's content-hash dedup).
+    """
+    global _ts_second, _ts_prefix
+    ns = time.time_ns()
+    second = ns // 1_000_000_000
+    if second != _ts_second:
+        _ts_second = second
+        _ts_prefix = datetime.utcfromtimestamp(second).isoformat()
+    return f"{_ts_prefix}.{ns % 1_000_000_000:09d}"
+
+
+def make_connector(uds: str = None) -> aiohttp.BaseConnector:
+    """Connector for the shared session: Unix socket when co-located, TCP otherwise"""
+    if uds:
+        return aiohttp.UnixConnector(path=uds)
+    return aiohttp.TCPConnector(limit=MAX_INFLIGHT_REQUESTS, keepalive_timeout=60)
+
+
+class TimerFdPacer:
+    """Paces a loop on a Linux timerfd for jitter-free fixed intervals
+
+    timer expirations accumulate in the kernel, so a slow iteration doesn't
+    silently drag the average rate below target the way time.sleep does.
+    Falls back to asyncio.sleep where timerfd is unavailable (non-Linux).
+    """
+
+    def __init__(self, interval_seconds: float):
+        self.interval = interval_seconds
+        self._fd = None
+        try:
+            self._libc = ctypes.CDLL(None, use_errno=True)
+            fd = self._libc.timerfd_create(CLOCK_MONOTONIC, 0)
+            if fd < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, os.strerror(errno))
+            os.set_blocking(fd, False)
+            self._fd = fd
+            self._arm()
+        except (OSError, AttributeError) as e:
+            logger.warning(f"⚠️  timerfd unavailable ({e}), pacing with asyncio.sleep")
+            self._fd = None
+
+    def _arm(self):
+        sec = int(self.interval)
+        nsec = int((self.interval - sec) * 1_000_000_000)
+        # struct itimerspec: { it_interval: timespec, it_value: timespec }
+        spec = (ctypes.c_long * 4)(sec, nsec, sec, nsec)
+        if self._libc.timerfd_settime(self._fd, 0, ctypes.byref(spec), None) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    async def tick(self):
+        """Wait for the next timer expiration"""
+        if self._fd is None:
+            await asyncio.sleep(self.interval)
+            return
+
+        loop = asyncio.get_running_loop()
+        readable = loop.create_future()
+        loop.add_reader(self._fd, readable.set_result, None)
+        try:
+            await readable
+        finally:
+            loop.remove_reader(self._fd)
+        os.read(self._fd, 8)  # consume the expiration count
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class EventBatcher:
+    """Buffers events and flushes them as bulk POSTs to /events/batch"""
+
+    def __init__(self, session: aiohttp.ClientSession, batch_url: str,
+                 max_events: int = BATCH_MAX_EVENTS, flush_interval: float = BATCH_FLUSH_INTERVAL):
+        self.session = session
+        self.batch_url = batch_url
+        self.max_events = max_events
+        self.flush_interval = flush_interval
+        self.events_sent = 0
+        self._buffer = deque()
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def add(self, event: Dict):
+        """Queue an event; flushes immediately once the batch is full"""
+        self._buffer.append(event)
+        if len(self._buffer) >= self.max_events:
+            await self._flush()
+
+    async def _flush_loop(self):
+        """Time-based flush so low-rate traffic isn't stuck in the buffer"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._flush()
+
+    async def _flush(self):
+        if not self._buffer:
+            return
+        batch = list(self._buffer)
+        self._buffer.clear()
+        try:
+            async with self.session.post(
+                self.batch_url,
+                data=orjson.dumps(batch),
+                headers={'Content-Type': 'application/json'},
+                timeout=aiohttp.ClientTimeout(total=5)
+            ) as response:
+                if response.status in (200, 202):
+                    self.events_sent += len(batch)
+                    logger.info(f"✓ Flushed batch of {len(batch)} events | Total: {self.events_sent}")
+                else:
+                    logger.warning(f"✗ Batch of {len(batch)} events | Status: {response.status}")
+        except Exception as e:
+            logger.error(f"✗ Batch of {len(batch)} events | Error: {e}")
+
+    async def close(self):
+        """Stop the flush loop and drain whatever is left in the buffer"""
+        self._flush_task.cancel()
+        await self._flush()
+
+
+def plan_session() -> List[tuple]:
+    """Pre-plan a whole shopping session as (event_type, product, quantity, delay) steps
+
+    All randomness for the session is drawn up front in bulk, so the send
+    path only iterates a ready-made list between POSTs.
+    """
+    steps = [("login", None, 1, random.uniform(1, 3))]
+
+    # Browse products (3-8 products)
+    num_views = random.randint(3, 8)
+    for product in random.choices(PRODUCT_NAMES, k=num_views):
+        steps.append(("view", product, 1, random.uniform(2, 5)))
+
+    # Add to cart (1-4 items)
+    num_cart = random.randint(1, 4)
+    cart = random.choices(PRODUCT_NAMES, k=num_cart)
+    for product, qty in zip(cart, random.choices((1, 2, 3), k=num_cart)):
+        steps.append(("add_to_cart", product, qty, random.uniform(1, 3)))
+
+    # Maybe remove an item (30% chance)
+    if cart and random.random() < 0.3:
+        product = random.choice(cart)
+        steps.append(("remove_from_cart", product, 1, random.uniform(1, 2)))
+        cart.remove(product)
+
+    # Purchase (70% conversion rate)
+    if cart and random.random() < 0.7:
+        for product in cart:
+            steps.append(("purchase", product, 1, random.uniform(0.5, 1)))
+
+    # Logout
+    steps.append(("logout", None, 1, 0))
+    return steps
+
 
 class ShoppingUser:
     """Simulates a single user's shopping behavior"""
-    
-    def __init__(self, user_id: str, ingestion_url: str):
+
+    def __init__(self, user_id: str, ingestion_url: str, batcher: EventBatcher = None):
         self.user_id = user_id
         self.ingestion_url = ingestion_url
+        self.batcher = batcher
         self.in_session = False
         self.cart = []
         self.event_count = 0
-        
-    def send_event(self, event_type: str, product: str = None, quantity: int = 1) -> bool:
-        """Send event to ingestion service"""
+
+    async def send_event(self, event_type: str, product: str = None, quantity: int = 1) -> bool:
+        """Queue event for the next bulk POST to the ingestion service"""
         try:
             event = {
                 "user_id": self.user_id,
                 "event_type": event_type,
-                "timestamp": datetime.utcnow().isoformat(),
+                "timestamp": utcnow_iso(),
             }
-            
+
             if product:
                 event["product"] = product
                 event["product_category"] = PRODUCTS[product]["category"]
                 event["product_price"] = PRODUCTS[product]["price"]
                 event["quantity"] = quantity
-            
-            response = requests.post(
-                self.ingestion_url,
-                json=event,
-                timeout=5
-            )
-            
-            if response.status_code == 200:
-                self.event_count += 1
-                logger.info(f"✓ {self.user_id} | {event_type:15} | Total: {self.event_count}")
-                return True
-            else:
-                logger.warning(f"✗ {self.user_id} | {event_type} | Status: {response.status_code}")
-                return False
-                
+
+            await self.batcher.add(event)
+            self.event_count += 1
+            logger.debug(f"✓ {self.user_id} | {event_type:15} | Total: {self.event_count}")
+            return True
+
         except Exception as e:
             logger.error(f"✗ {self.user_id} | {event_type} | Error: {e}")
             return False
-    
-    def simulate_session(self):
-        """Simulate a shopping session"""
-        # Login
-        self.send_event("login")
+
+    async def simulate_session(self):
+        """Simulate a shopping session from a pre-planned step list"""
         self.in_session = True
-        time.sleep(random.uniform(1, 3))
-        
-        # Browse products (3-8 products)
-        num_views = random.randint(3, 8)
-        for _ in range(num_views):
-            product = random.choice(list(PRODUCTS.keys()))
-            self.send_event("view", product=product)
-            time.sleep(random.uniform(2, 5))
-        
-        # Add to cart (1-4 items)
-        num_cart = random.randint(1, 4)
-        for _ in range(num_cart):
-            product = random.choice(list(PRODUCTS.keys()))
-            qty = random.randint(1, 3)
-            self.send_event("add_to_cart", product=product, quantity=qty)
-            self.cart.append(product)
-            time.sleep(random.uniform(1, 3))
-        
-        # Maybe remove an item (30% chance)
-        if self.cart and random.random() < 0.3:
-            product = random.choice(self.cart)
-            self.send_event("remove_from_cart", product=product)
-            self.cart.remove(product)
-            time.sleep(random.uniform(1, 2))
-        
-        # Purchase (70% conversion rate)
-        if self.cart and random.random() < 0.7:
-            for product in self.cart:
-                self.send_event("purchase", product=product)
-                time.sleep(random.uniform(0.5, 1))
-        
-        # Logout
-        self.send_event("logout")
+
+        for event_type, product, quantity, delay in plan_session():
+            await self.send_event(event_type, product=product, quantity=quantity)
+
+            if event_type == "add_to_cart":
+                self.cart.append(product)
+            elif event_type == "remove_from_cart":
+                self.cart.remove(product)
+
+            if delay:
+                await asyncio.sleep(delay)
+
         self.in_session = False
         self.cart = []
 
 
 class EventSimulator:
     """Main event simulator coordinator"""
-    
-    def __init__(self, ingestion_url: str, num_users: int = 5, events_per_minute: int = 10):
+
+    def __init__(self, ingestion_url: str, num_users: int = 5, events_per_minute: int = 10,
+                 uds: str = None):
         self.ingestion_url = ingestion_url
         self.num_users = num_users
         self.events_per_minute = events_per_minute
+        self.uds = uds
         self.total_events = 0
         self.users = [ShoppingUser(f"user_{i}", ingestion_url) for i in range(num_users)]
-        
+
+    def _make_session(self) -> aiohttp.ClientSession:
+        """Create the shared HTTP session with a keep-alive connection pool"""
+        return aiohttp.ClientSession(connector=make_connector(self.uds))
+
+    def _make_batcher(self, session: aiohttp.ClientSession) -> EventBatcher:
+        """Create the shared batcher targeting the bulk ingestion endpoint"""
+        return EventBatcher(session, f"{self.ingestion_url}/batch")
+
     def run_continuous(self, duration_seconds: int = None):
         """Run continuous event generation"""
+        try:
+            asyncio.run(self._run_continuous(duration_seconds))
+        except KeyboardInterrupt:
+            logger.info("\n⏹️  Simulator stopped by user")
+            self._print_stats()
+
+    async def _run_continuous(self, duration_seconds: int = None):
         logger.info(f"🛍️  Starting Shopping Store Simulator")
         logger.info(f"   Users: {self.num_users}")
         logger.info(f"   Target: {self.events_per_minute} events/min")
         logger.info(f"   Endpoint: {self.ingestion_url}")
         logger.info(f"{'=' * 70}")
-        
+
         start_time = time.time()
-        
-        try:
-            while True:
-                # Check duration if specified
-                if duration_seconds and (time.time() - start_time) > duration_seconds:
-                    logger.info("✓ Duration limit reached, stopping simulator")
-                    break
-                
-                # Randomly pick a user to start a session
-                user = random.choice(self.users)
-                
-                # Run session in background thread
-                thread = threading.Thread(target=user.simulate_session, daemon=True)
-                thread.start()
-                
-                # Calculate sleep time based on events_per_minute
-                # Average session generates ~12 events
-                session_interval = (60 / self.events_per_minute) * 12
-                time.sleep(session_interval)
-                
-        except KeyboardInterrupt:
-            logger.info("\n⏹️  Simulator stopped by user")
-            self._print_stats()
-    
+
+        # Calculate session cadence based on events_per_minute
+        # Average session generates ~12 events
+        session_interval = (60 / self.events_per_minute) * 12
+        pacer = TimerFdPacer(session_interval)
+
+        async with self._make_session() as session:
+            batcher = self._make_batcher(session)
+            for user in self.users:
+                user.batcher = batcher
+
+            # Persistent pool of session workers fed by a bounded queue, so
+            # the pacing loop never creates tasks and in-flight sessions
+            # are capped
+            session_queue = asyncio.Queue(maxsize=self.num_users * 2)
+
+            async def session_worker():
+                while True:
+                    user = await session_queue.get()
+                    try:
+                        await user.simulate_session()
+                    finally:
+                        session_queue.task_done()
+
+            workers = [asyncio.create_task(session_worker())
+                       for _ in range(self.num_users * 2)]
+
+            try:
+                while True:
+                    # Check duration if specified
+                    if duration_seconds and (time.time() - start_time) > duration_seconds:
+                        logger.info("✓ Duration limit reached, stopping simulator")
+                        break
+
+                    # Randomly pick a user to start a session; if every
+                    # worker is busy, skip the tick rather than queue up debt
+                    try:
+                        session_queue.put_nowait(random.choice(self.users))
+                    except asyncio.QueueFull:
+                        logger.debug("All session workers busy, skipping tick")
+
+                    await pacer.tick()
+            finally:
+                pacer.close()
+
+            # Let queued sessions finish, stop the workers, drain the batcher
+            await session_queue.join()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await batcher.close()
+
     def run_load_test(self, concurrent_users: int = 10, duration_seconds: int = 60):
-        """Run a load test with concurrent users"""
+        """Run a load test with concurrent users spread across CPU cores
+
+        A single Python process tops out on one core encoding/decoding all
+        the traffic, so the users are split over a process pool; each worker
+        process runs its share on its own asyncio event loop.
+        """
+        num_workers = min(os.cpu_count() or 1, concurrent_users)
+
         logger.info(f"📊 Starting Load Test")
         logger.info(f"   Concurrent users: {concurrent_users}")
+        logger.info(f"   Worker processes: {num_workers}")
         logger.info(f"   Duration: {duration_seconds}s")
         logger.info(f"{'=' * 70}")
-        
-        threads = []
-        start_time = time.time()
-        
+
+        # Split users as evenly as possible across workers
+        per_worker = [concurrent_users // num_workers] * num_workers
+        for i in range(concurrent_users % num_workers):
+            per_worker[i] += 1
+
         try:
-            # Launch concurrent user sessions
-            for i in range(concurrent_users):
-                user = ShoppingUser(f"load_test_user_{i}", self.ingestion_url)
-                thread = threading.Thread(target=user.simulate_session, daemon=True)
-                thread.start()
-                threads.append(thread)
-                time.sleep(0.1)  # Stagger starts
-            
-            # Wait for duration
-            while (time.time() - start_time) < duration_seconds:
-                active = sum(1 for t in threads if t.is_alive())
-                logger.info(f"Active threads: {active}/{concurrent_users}")
-                time.sleep(5)
-            
-            # Wait for remaining threads
-            for thread in threads:
-                thread.join(timeout=30)
-            
-            logger.info("✓ Load test completed")
-            
+            with ProcessPoolExecutor(max_workers=num_workers) as executor:
+                futures = [
+                    executor.submit(_load_test_worker, worker_id, num_users,
+                                    self.ingestion_url, duration_seconds, self.uds)
+                    for worker_id, num_users in enumerate(per_worker)
+                ]
+                total_events = sum(f.result() for f in futures)
+
+            logger.info(f"✓ Load test completed: {total_events} events "
+                        f"from {concurrent_users} users across {num_workers} processes")
+
         except KeyboardInterrupt:
             logger.info("\n⏹️  Load test stopped by user")
-    
+
     def _print_stats(self):
         """Print simulator statistics"""
         total = sum(user.event_count for user in self.users)
@@ -208,6 +409,67 @@ class EventSimulator:
         logger.info(f"{'=' * 70}")
 
 
+def _load_test_worker(worker_id: int, num_users: int, ingestion_url: str,
+                      duration_seconds: int, uds: str = None) -> int:
+    """Entry point for one load-test worker process; returns its event count"""
+    return asyncio.run(_run_load_test_users(worker_id, num_users, ingestion_url,
+                                            duration_seconds, uds))
+
+
+async def _run_load_test_users(worker_id: int, num_users: int, ingestion_url: str,
+                               duration_seconds: int, uds: str = None) -> int:
+    start_time = time.time()
+
+    async with aiohttp.ClientSession(connector=make_connector(uds)) as session:
+        batcher = EventBatcher(session, f"{ingestion_url}/batch")
+
+        # Bound in-flight sessions; queued users wait their turn instead of
+        # piling thousands of live tasks onto the loop
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_SESSIONS)
+
+        async def run_session(user: ShoppingUser):
+            async with semaphore:
+                await user.simulate_session()
+
+        # Launch this worker's user sessions
+        users = []
+        tasks = []
+        for i in range(num_users):
+            user = ShoppingUser(f"load_test_w{worker_id}_user_{i}", ingestion_url, batcher)
+            users.append(user)
+            tasks.append(asyncio.create_task(run_session(user)))
+            await asyncio.sleep(0.1)  # Stagger starts
+
+        # Wait for duration
+        while (time.time() - start_time) < duration_seconds:
+            active = sum(1 for t in tasks if not t.done())
+            logger.info(f"Worker {worker_id} | Active sessions: {active}/{num_users}")
+            if active == 0:
+                break
+            await asyncio.sleep(5)
+
+        # Wait for remaining sessions, then drain the batcher
+        await asyncio.wait(tasks, timeout=30)
+        await batcher.close()
+
+        return sum(user.event_count for user in users)
+
+
+async def check_endpoint(url: str, uds: str = None) -> bool:
+    """Verify the ingestion endpoint is reachable before starting"""
+    health_url = url.replace("/events", "/health")
+    try:
+        async with aiohttp.ClientSession(connector=make_connector(uds)) as session:
+            async with session.get(health_url, timeout=aiohttp.ClientTimeout(total=5)) as response:
+                if response.status != 200:
+                    logger.warning(f"⚠️  Warning: Endpoint returned {response.status}")
+        return True
+    except Exception as e:
+        logger.error(f"✗ Cannot reach {url}: {e}")
+        logger.error("  Make sure the ingestion service is running!")
+        return False
+
+
 def main():
     parser = argparse.ArgumentParser(description="Shopping Store Event Simulator")
     parser.add_argument(
@@ -239,25 +501,25 @@ def main():
         metavar="SECONDS",
         help="Run for N seconds then stop (default: run forever)"
     )
-    
+    parser.add_argument(
+        "--uds",
+        metavar="PATH",
+        help="Connect over a Unix domain socket (when ingestion runs on this host)"
+    )
+
     args = parser.parse_args()
-    
+
     # Verify endpoint is reachable
-    try:
-        response = requests.get(args.url.replace("/events", "/health"), timeout=5)
-        if response.status_code != 200:
-            logger.warning(f"⚠️  Warning: Endpoint returned {response.status_code}")
-    except Exception as e:
-        logger.error(f"✗ Cannot reach {args.url}: {e}")
-        logger.error("  Make sure the ingestion service is running!")
+    if not asyncio.run(check_endpoint(args.url, uds=args.uds)):
         return
-    
+
     simulator = EventSimulator(
         ingestion_url=args.url,
         num_users=args.users,
-        events_per_minute=args.events_per_minute
+        events_per_minute=args.events_per_minute,
+        uds=args.uds
     )
-    
+
     if args.load_test:
         simulator.run_load_test(
             concurrent_users=args.load_test,
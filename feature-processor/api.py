@@ -1,8 +1,12 @@
 from flask import Flask, jsonify, request
+import orjson
 import redis
 import psycopg2
+import psycopg2.extras
+import psycopg2.pool
 import os
 import logging
+import threading
 from datetime import datetime
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
 
@@ -17,15 +21,41 @@ API_LATENCY = Histogram('api_latency_seconds', 'API request latency', ['endpoint
 CACHE_HITS = Counter('api_cache_hits_total', 'API cache hits')
 CACHE_MISSES = Counter('api_cache_misses_total', 'API cache misses')
 
-# Redis client
-redis_client = redis.Redis(
-    host=os.getenv('REDIS_HOST', 'redis'),
-    port=int(os.getenv('REDIS_PORT', '6379')),
-    db=0,
-    decode_responses=True,
-    socket_connect_timeout=5,
-    max_connections=50
-)
+# Pre-bound metric children so hot paths do a bare .inc()/.time()
+# instead of a labels() lookup per request
+REQ_FEATURES_200 = API_REQUESTS.labels(endpoint='/features', method='GET', status='200')
+REQ_FEATURES_404 = API_REQUESTS.labels(endpoint='/features', method='GET', status='404')
+REQ_FEATURES_500 = API_REQUESTS.labels(endpoint='/features', method='GET', status='500')
+REQ_BATCH_200 = API_REQUESTS.labels(endpoint='/features/batch', method='GET', status='200')
+REQ_BATCH_400 = API_REQUESTS.labels(endpoint='/features/batch', method='GET', status='400')
+REQ_BATCH_500 = API_REQUESTS.labels(endpoint='/features/batch', method='GET', status='500')
+REQ_SINGLE_200 = API_REQUESTS.labels(endpoint='/features/single', method='GET', status='200')
+REQ_SINGLE_404 = API_REQUESTS.labels(endpoint='/features/single', method='GET', status='404')
+REQ_SINGLE_500 = API_REQUESTS.labels(endpoint='/features/single', method='GET', status='500')
+LATENCY_FEATURES = API_LATENCY.labels(endpoint='/features/<user_id>')
+LATENCY_BATCH = API_LATENCY.labels(endpoint='/features/batch')
+LATENCY_SINGLE = API_LATENCY.labels(endpoint='/features/<user_id>/<feature_name>')
+
+# Redis client. REDIS_SOCKET selects a Unix domain socket for
+# co-located deployments, skipping the TCP loopback
+_redis_socket = os.getenv('REDIS_SOCKET')
+if _redis_socket:
+    redis_client = redis.Redis(
+        unix_socket_path=_redis_socket,
+        db=0,
+        decode_responses=True,
+        socket_connect_timeout=5,
+        max_connections=50
+    )
+else:
+    redis_client = redis.Redis(
+        host=os.getenv('REDIS_HOST', 'redis'),
+        port=int(os.getenv('REDIS_PORT', '6379')),
+        db=0,
+        decode_responses=True,
+        socket_connect_timeout=5,
+        max_connections=50
+    )
 
 # Database configuration
 DB_CONFIG = {
@@ -36,9 +66,76 @@ DB_CONFIG = {
     'password': os.getenv('POSTGRES_PASSWORD', 'postgres')
 }
 
+# Connection pool (created lazily so the API can come up before the DB)
+db_pool = None
+_db_pool_lock = threading.Lock()
+
 def get_db_connection():
-    """Get database connection"""
-    return psycopg2.connect(**DB_CONFIG)
+    """Check out a database connection from the pool"""
+    global db_pool
+    if db_pool is None:
+        with _db_pool_lock:
+            if db_pool is None:
+                db_pool = psycopg2.pool.ThreadedConnectionPool(minconn=5, maxconn=50, **DB_CONFIG)
+    return db_pool.getconn()
+
+def put_db_connection(conn):
+    """Return a connection to the pool"""
+    if db_pool is not None:
+        db_pool.putconn(conn)
+
+def json_response(payload, status=200):
+    """Serialize a response with orjson (much faster than jsonify on feature payloads)"""
+    return app.response_class(orjson.dumps(payload), status=status, mimetype='application/json')
+
+def _serve_from_cache(user_id, cached_features):
+    """Assemble the cache-hit response body for get_features
+
+    Each hash field already holds serialized JSON, so the body is stitched
+    together from the raw fragments - no per-field loads and no re-dump of
+    the whole payload on the hottest path in the API.
+    """
+    parts = [b'{"user_id":', orjson.dumps(user_id), b',"features":{']
+    first = True
+    for name, value in cached_features.items():
+        if not first:
+            parts.append(b',')
+        first = False
+        parts.append(orjson.dumps(name))
+        parts.append(b':')
+        parts.append(value.encode())
+    parts.append(b'},"source":"cache","timestamp":')
+    parts.append(orjson.dumps(datetime.utcnow().isoformat()))
+    parts.append(b'}')
+    return app.response_class(b''.join(parts), mimetype='application/json')
+
+def _decode_cached_feature(cached_value):
+    """Decode a cached single-feature entry, tolerating legacy formats
+
+    Old deploys stored bare values instead of {'value', 'computed_at'}
+    objects; anything that doesn't decode to that shape is treated as a
+    cache miss so the caller falls through to the database.
+    """
+    if not cached_value:
+        return None
+    try:
+        cached = orjson.loads(cached_value)
+    except orjson.JSONDecodeError:
+        return None
+    if isinstance(cached, dict) and 'value' in cached and 'computed_at' in cached:
+        return cached
+    return None
+
+def cache_features_hash(cache_key, features, ttl=300, pipe=None):
+    """Cache a user's features as a Redis HASH, one JSON value per feature"""
+    own_pipe = pipe is None
+    if own_pipe:
+        pipe = redis_client.pipeline(transaction=False)
+    pipe.delete(cache_key)  # drop stale fields before the refill
+    pipe.hset(cache_key, mapping={name: orjson.dumps(value) for name, value in features.items()})
+    pipe.expire(cache_key, ttl)
+    if own_pipe:
+        pipe.execute()
 
 @app.route('/health', methods=['GET'])
 def health():
@@ -53,7 +150,7 @@ def health():
     try:
         # Check Database
         conn = get_db_connection()
-        conn.close()
+        put_db_connection(conn)
         db_status = "healthy"
     except:
         db_status = "unhealthy"
@@ -73,127 +170,262 @@ def get_features(user_id):
     Get all features for a user
     Tries Redis cache first, falls back to database
     """
-    with API_LATENCY.labels(endpoint='/features/<user_id>').time():
+    with LATENCY_FEATURES.time():
         try:
-            # Try cache first
+            # Fast path: pre-serialized response body, only the timestamp
+            # placeholder left to fill in
+            body_key = f"features:body:{user_id}"
+            cached_body = redis_client.get(body_key)
+
+            if cached_body:
+                CACHE_HITS.inc()
+                REQ_FEATURES_200.inc()
+                body = cached_body.replace('"__TS__"', orjson.dumps(datetime.utcnow().isoformat()).decode())
+                return app.response_class(body, mimetype='application/json')
+
+            # Per-feature hash (kept warm by the single/batch endpoints)
             cache_key = f"features:{user_id}"
-            cached_features = redis_client.get(cache_key)
-            
+            try:
+                cached_features = redis_client.hgetall(cache_key)
+            except redis.exceptions.ResponseError:
+                # Legacy deploys stored this key as a string blob
+                # (WRONGTYPE); drop it and refill from the database below
+                redis_client.delete(cache_key)
+                cached_features = None
+
             if cached_features:
                 CACHE_HITS.inc()
-                API_REQUESTS.labels(endpoint='/features', method='GET', status='200').inc()
-                import json
-                return jsonify({
-                    'user_id': user_id,
-                    'features': json.loads(cached_features),
-                    'source': 'cache',
-                    'timestamp': datetime.utcnow().isoformat()
-                })
+                REQ_FEATURES_200.inc()
+                return _serve_from_cache(user_id, cached_features)
             
             # Cache miss - query database
             CACHE_MISSES.inc()
             conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT feature_name, feature_value, computed_at
-                FROM features
-                WHERE user_id = %s
-                ORDER BY computed_at DESC
-            """, (user_id,))
-            
-            rows = cursor.fetchall()
-            cursor.close()
-            conn.close()
-            
+            try:
+                cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+
+                # features holds one upserted row per (user_id, feature_name),
+                # so this is a plain index scan - no sort needed
+                cursor.execute("""
+                    SELECT feature_name, feature_value, computed_at
+                    FROM features
+                    WHERE user_id = %s
+                """, (user_id,))
+
+                rows = cursor.fetchall()
+                cursor.close()
+            finally:
+                put_db_connection(conn)
+
             if not rows:
-                API_REQUESTS.labels(endpoint='/features', method='GET', status='404').inc()
-                return jsonify({'error': 'User not found'}), 404
-            
-            # Build features dict
-            features = {}
-            for row in rows:
-                feature_name, feature_value, computed_at = row
-                features[feature_name] = {
-                    'value': feature_value,
-                    'computed_at': computed_at.isoformat() if hasattr(computed_at, 'isoformat') else str(computed_at)
+                REQ_FEATURES_404.inc()
+                return json_response({'error': 'User not found'}, status=404)
+
+            # Build features dict (computed_at is TIMESTAMPTZ, always a datetime)
+            features = {
+                row['feature_name']: {
+                    'value': row['feature_value'],
+                    'computed_at': row['computed_at'].isoformat()
                 }
-            
-            # Cache for 5 minutes
-            import json
-            redis_client.setex(cache_key, 300, json.dumps(features))
-            
-            API_REQUESTS.labels(endpoint='/features', method='GET', status='200').inc()
-            return jsonify({
+                for row in rows
+            }
+
+            # Cache for 5 minutes: the per-feature hash plus the ready-made
+            # response body with a timestamp placeholder
+            body_template = orjson.dumps({
+                'user_id': user_id,
+                'features': features,
+                'source': 'cache',
+                'timestamp': '__TS__'
+            })
+            pipe = redis_client.pipeline(transaction=False)
+            cache_features_hash(cache_key, features, pipe=pipe)
+            pipe.setex(body_key, 300, body_template)
+            pipe.execute()
+
+            REQ_FEATURES_200.inc()
+            return json_response({
                 'user_id': user_id,
                 'features': features,
                 'source': 'database',
                 'timestamp': datetime.utcnow().isoformat()
             })
-            
+
         except Exception as e:
             logger.error(f"Error fetching features: {e}")
-            API_REQUESTS.labels(endpoint='/features', method='GET', status='500').inc()
-            return jsonify({'error': str(e)}), 500
+            REQ_FEATURES_500.inc()
+            return json_response({'error': str(e)}, status=500)
+
+@app.route('/features/batch', methods=['GET'])
+def get_features_batch():
+    """
+    Get all features for several users in one call
+    One Redis MGET round-trip for the cache, one SQL query for the misses
+    """
+    with LATENCY_BATCH.time():
+        try:
+            user_ids = [u for u in request.args.get('user_ids', '').split(',') if u]
+            if not user_ids:
+                REQ_BATCH_400.inc()
+                return json_response({'error': 'user_ids query parameter is required'}, status=400)
+
+            # Fetch every cached hash in a single round-trip. Legacy
+            # string-valued keys raise WRONGTYPE; surface those as per-user
+            # errors instead of failing the whole pipeline
+            pipe = redis_client.pipeline(transaction=False)
+            for user_id in user_ids:
+                pipe.hgetall(f"features:{user_id}")
+            cached_hashes = pipe.execute(raise_on_error=False)
+
+            results = {}
+            missing = []
+            for user_id, cached in zip(user_ids, cached_hashes):
+                if isinstance(cached, Exception):
+                    # Stale pre-hash cache entry: drop it and treat as a miss
+                    redis_client.delete(f"features:{user_id}")
+                    cached = None
+                if cached:
+                    CACHE_HITS.inc()
+                    results[user_id] = {
+                        'features': {name: orjson.loads(value) for name, value in cached.items()},
+                        'source': 'cache'
+                    }
+                else:
+                    CACHE_MISSES.inc()
+                    missing.append(user_id)
+
+            # One query for all cache misses
+            if missing:
+                conn = get_db_connection()
+                try:
+                    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+
+                    cursor.execute("""
+                        SELECT user_id, feature_name, feature_value, computed_at
+                        FROM features
+                        WHERE user_id = ANY(%s)
+                    """, (missing,))
+
+                    rows = cursor.fetchall()
+                    cursor.close()
+                finally:
+                    put_db_connection(conn)
+
+                by_user = {}
+                for row in rows:
+                    by_user.setdefault(row['user_id'], {})[row['feature_name']] = {
+                        'value': row['feature_value'],
+                        'computed_at': row['computed_at'].isoformat()
+                    }
+
+                # Refill the cache with one pipelined round-trip
+                pipe = redis_client.pipeline(transaction=False)
+                for user_id, features in by_user.items():
+                    cache_features_hash(f"features:{user_id}", features, pipe=pipe)
+                    results[user_id] = {'features': features, 'source': 'database'}
+                pipe.execute()
+
+            REQ_BATCH_200.inc()
+            return json_response({
+                'results': results,
+                'timestamp': datetime.utcnow().isoformat()
+            })
+
+        except Exception as e:
+            logger.error(f"Error fetching batch features: {e}")
+            REQ_BATCH_500.inc()
+            return json_response({'error': str(e)}, status=500)
 
 @app.route('/features/<user_id>/<feature_name>', methods=['GET'])
 def get_single_feature(user_id, feature_name):
     """Get a specific feature for a user"""
-    with API_LATENCY.labels(endpoint='/features/<user_id>/<feature_name>').time():
+    with LATENCY_SINGLE.time():
         try:
-            # Try cache first
+            # Try the per-user hash first - one field read, no full-blob decode
+            hash_key = f"features:{user_id}"
+            try:
+                cached_value = redis_client.hget(hash_key, feature_name)
+            except redis.exceptions.ResponseError:
+                # Legacy string-valued key (WRONGTYPE): drop it, treat as miss
+                redis_client.delete(hash_key)
+                cached_value = None
+
+            cached = _decode_cached_feature(cached_value)
+            if cached is not None:
+                CACHE_HITS.inc()
+                REQ_SINGLE_200.inc()
+                return json_response({
+                    'user_id': user_id,
+                    'feature_name': feature_name,
+                    'value': cached['value'],
+                    'computed_at': cached['computed_at'],
+                    'source': 'cache'
+                })
+
+            # Fall back to the dedicated single-feature key
             cache_key = f"feature:{user_id}:{feature_name}"
             cached_value = redis_client.get(cache_key)
-            
-            if cached_value:
+
+            cached = _decode_cached_feature(cached_value)
+            if cached is not None:
                 CACHE_HITS.inc()
-                API_REQUESTS.labels(endpoint='/features/single', method='GET', status='200').inc()
-                return jsonify({
+                REQ_SINGLE_200.inc()
+                return json_response({
                     'user_id': user_id,
                     'feature_name': feature_name,
-                    'value': cached_value,
+                    'value': cached['value'],
+                    'computed_at': cached['computed_at'],
                     'source': 'cache'
                 })
+            elif cached_value:
+                # Legacy entry held a bare value, not the JSON object shape;
+                # drop it and refill from the database below
+                redis_client.delete(cache_key)
             
             # Cache miss - query database
             CACHE_MISSES.inc()
             conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT feature_value, computed_at
-                FROM features
-                WHERE user_id = %s AND feature_name = %s
-                ORDER BY computed_at DESC
-                LIMIT 1
-            """, (user_id, feature_name))
-            
-            row = cursor.fetchone()
-            cursor.close()
-            conn.close()
-            
+            try:
+                cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+
+                # Primary-key lookup: at most one row per (user_id, feature_name)
+                cursor.execute("""
+                    SELECT feature_value, computed_at
+                    FROM features
+                    WHERE user_id = %s AND feature_name = %s
+                """, (user_id, feature_name))
+
+                row = cursor.fetchone()
+                cursor.close()
+            finally:
+                put_db_connection(conn)
+
             if not row:
-                API_REQUESTS.labels(endpoint='/features/single', method='GET', status='404').inc()
-                return jsonify({'error': 'Feature not found'}), 404
-            
-            feature_value, computed_at = row
-            
-            # Cache for 5 minutes
-            redis_client.setex(cache_key, 300, str(feature_value))
-            
-            API_REQUESTS.labels(endpoint='/features/single', method='GET', status='200').inc()
-            return jsonify({
+                REQ_SINGLE_404.inc()
+                return json_response({'error': 'Feature not found'}, status=404)
+
+            feature_value = row['feature_value']
+            computed_at_iso = row['computed_at'].isoformat()
+
+            # Cache for 5 minutes under the dedicated key; the per-user hash
+            # is only ever written as a complete set so partial fills can't
+            # masquerade as a full-features cache hit
+            redis_client.setex(cache_key, 300,
+                               orjson.dumps({'value': feature_value, 'computed_at': computed_at_iso}))
+
+            REQ_SINGLE_200.inc()
+            return json_response({
                 'user_id': user_id,
                 'feature_name': feature_name,
                 'value': feature_value,
-                'computed_at': computed_at.isoformat() if hasattr(computed_at, 'isoformat') else str(computed_at),
+                'computed_at': computed_at_iso,
                 'source': 'database'
             })
-            
+
         except Exception as e:
             logger.error(f"Error fetching feature: {e}")
-            API_REQUESTS.labels(endpoint='/features/single', method='GET', status='500').inc()
-            return jsonify({'error': str(e)}), 500
+            REQ_SINGLE_500.inc()
+            return json_response({'error': str(e)}, status=500)
 
 @app.route('/metrics', methods=['GET'])
 def metrics():
@@ -209,11 +441,14 @@ def index():
         'endpoints': {
             '/health': 'Health check',
             '/features/<user_id>': 'Get all features for a user',
+            '/features/batch?user_ids=a,b,c': 'Get all features for several users',
             '/features/<user_id>/<feature_name>': 'Get specific feature for a user',
             '/metrics': 'Prometheus metrics'
         }
     })
 
 if __name__ == '__main__':
-    logger.info("Starting Feature Serving API on :8083")
+    # Dev-only entrypoint; deployments run under gunicorn with gevent workers
+    # (gunicorn -k gevent -w 4 --worker-connections 1000 -b 0.0.0.0:8083 api:app)
+    logger.info("Starting Feature Serving API on :8083 (dev server)")
     app.run(host='0.0.0.0', port=8083, debug=False)
@@ -0,0 +1,15 @@
+"""Gunicorn configuration for the feature API (gevent workers)
+
+gevent monkey-patches Python-level sockets, but psycopg2 is a C
+extension whose libpq calls would otherwise block the worker's whole
+event loop on every cache-miss DB query. psycogreen puts psycopg2 into
+non-blocking mode so Postgres I/O yields to the hub like the Redis
+calls do.
+"""
+
+
+def post_fork(server, worker):
+    from psycogreen.gevent import patch_psycopg
+
+    patch_psycopg()
+    worker.log.info("psycopg2 patched for gevent (worker pid %s)", worker.pid)
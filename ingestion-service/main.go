@@ -6,6 +6,7 @@ import (
 	"encoding/hex"
 	"encoding/json"
 	"log"
+	"net"
 	"net/http"
 	"os"
 	"sync"
@@ -74,9 +75,26 @@ func main() {
 
 	http.HandleFunc("/health", healthHandler)
 	http.HandleFunc("/events", eventsHandler)
+	http.HandleFunc("/events/batch", eventsBatchHandler)
 	http.HandleFunc("/metrics", metricsHandler)
 
 	log.Println("Worker pool started with", workerPool, "workers")
+
+	// Optionally serve on a Unix domain socket too, so co-located clients
+	// can skip the TCP loopback
+	if socketPath := os.Getenv("INGEST_SOCKET"); socketPath != "" {
+		os.Remove(socketPath)
+		listener, err := net.Listen("unix", socketPath)
+		if err != nil {
+			log.Printf("Warning: failed to listen on %s: %v", socketPath, err)
+		} else {
+			log.Println("Also listening on unix socket", socketPath)
+			go func() {
+				log.Fatal(http.Serve(listener, nil))
+			}()
+		}
+	}
+
 	log.Fatal(http.ListenAndServe(":8081", nil))
 }
 
@@ -145,6 +163,63 @@ func eventsHandler(w http.ResponseWriter, r *http.Request) {
 	}
 }
 
+func eventsBatchHandler(w http.ResponseWriter, r *http.Request) {
+	if r.Method != "POST" {
+		http.Error(w, "Method not allowed", http.StatusMethodNotAllowed)
+		return
+	}
+
+	var events []map[string]interface{}
+	if err := json.NewDecoder(r.Body).Decode(&events); err != nil {
+		http.Error(w, "Invalid JSON", http.StatusBadRequest)
+		return
+	}
+
+	ingestedAt := time.Now().UTC().Format(time.RFC3339)
+	accepted := 0
+	duplicates := 0
+	dropped := 0
+
+	for _, event := range events {
+		// Check for duplicate events using Redis
+		eventID := generateEventID(event)
+		isDuplicate, err := checkDuplicate(eventID)
+		if err != nil {
+			log.Printf("Redis check failed: %v", err)
+		} else if isDuplicate {
+			duplicates++
+			continue
+		}
+
+		// Enrich event with metadata
+		event["ingested_at"] = ingestedAt
+		event["service"] = "ingestion"
+		event["event_id"] = eventID
+
+		// Send to async worker pool (non-blocking)
+		select {
+		case eventChannel <- event:
+			accepted++
+		default:
+			// Channel full, drop remaining events with backpressure
+			dropped++
+		}
+	}
+
+	if dropped > 0 {
+		http.Error(w, "Service overloaded, try again later", http.StatusServiceUnavailable)
+		return
+	}
+
+	w.Header().Set("Content-Type", "application/json")
+	w.WriteHeader(http.StatusAccepted)
+	json.NewEncoder(w).Encode(map[string]interface{}{
+		"status":     "accepted",
+		"accepted":   accepted,
+		"duplicates": duplicates,
+	})
+}
+
 func metricsHandler(w http.ResponseWriter, r *http.Request) {
 	w.Header().Set("Content-Type", "application/json")
 